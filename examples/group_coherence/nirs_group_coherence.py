@@ -35,12 +35,12 @@ minutes = 1
 sig_length = int(fs * 60 * minutes)
 
 
-def load_mat(filename: str) -> ndarray:
+def load_mat(filename: str, dtype=np.float32) -> ndarray:
     """
     Loads a signal from one of the .mat files.
     """
     cell = list(scipy.io.loadmat(filename).values())[3]
-    out = np.empty((cell.shape[1], sig_length))
+    out = np.empty((cell.shape[1], sig_length), dtype=dtype)
 
     for index in range(cell.shape[1]):
         out[index, :] = cell[0, index][0, :sig_length]
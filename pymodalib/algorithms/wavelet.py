@@ -21,7 +21,6 @@ Wavelet transform.
 from typing import Tuple
 
 from numpy import ndarray
-from pymodalib.implementations.python.wavelet.wavelet_transform import MorseWavelet
 
 from pymodalib.utils.parameters import verify_parameter, BadParametersException
 
@@ -134,21 +133,11 @@ def wavelet_transform(
 
     if implementation == "python":
         from pymodalib.implementations.python.wavelet.wavelet_transform import (
-            LognormWavelet,
-            MorletWavelet,
+            window_params,
             wavelet_transform as python_impl,
         )
 
-        if wavelet == "Lognorm":
-            wp = LognormWavelet(resolution)
-        elif wavelet == "Morlet":
-            wp = MorletWavelet(resolution)
-        elif wavelet == "Bump":
-            raise Exception("Bump wavelet is not supported yet.")
-        elif wavelet == "Morse-a":
-            wp = MorseWavelet(3, resolution)
-        else:
-            raise ValueError(f"Unknown wavelet: '{wavelet}'")
+        wp = window_params(wavelet, resolution)
 
         result = python_impl(
             signal=signal,
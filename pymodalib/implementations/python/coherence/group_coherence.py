@@ -13,18 +13,34 @@
 #
 #  You should have received a copy of the GNU General Public License
 #  along with this program. If not, see <https://www.gnu.org/licenses/>.
-import functools
+import inspect
 import multiprocessing
+import multiprocessing.pool
 import warnings
-from typing import Tuple, Callable, Any
+from typing import Tuple, Callable, Any, Optional, Dict
 
+import numba
 import numpy as np
+from numba import njit, prange
 from numpy import ndarray
 
 import pymodalib
-from pymodalib.algorithms.coherence import wphcoh
 from pymodalib.algorithms.wavelet import wavelet_transform
+from pymodalib.implementations.python.wavelet.wavelet_transform import (
+    wavelet_frequencies,
+    window_params,
+)
 from pymodalib.utils.chunks import array_split
+from pymodalib.utils.shared import SharedArray, ensure_resource_tracker
+
+
+# Number of subjects whose coherences are calculated together. Each process holds the rows
+# and columns of the coherence array for one batch at a time.
+COHERENCE_BATCH_SIZE = 8
+
+# Number of elements (frequencies x times) in the tile of each wavelet transform which is
+# processed at once when calculating coherence.
+COHERENCE_TIME_TILE_ELEMENTS = 2 ** 16
 
 
 class CoherenceException(Exception):
@@ -39,256 +55,536 @@ def wt(signal: ndarray, fs: float, *args, **kwargs) -> Tuple[ndarray, ndarray]:
     return wt, freq
 
 
-def _chunk_wt(
-    signals_a: ndarray, signals_b: ndarray, fs: float, *args, **kwargs
-) -> Tuple[ndarray, ndarray]:
+def _wt_arguments(signal: ndarray, fs: float, *args, **kwargs) -> dict:
     """
-    Used to perform the wavelet transform for chunks of the data. The caller is
-    responsible for splitting the data into chunks.
+    Returns all arguments which the wavelet transform would be called with, including
+    the default values of arguments which were not passed.
     """
-    out_a = None
-    out_b = None
-
-    x, y = signals_a.shape
-    for index in range(x):
-        _wt_a, _ = wt(signals_a[index, :], fs, *args, **kwargs)
-        _wt_b, _ = wt(signals_b[index, :], fs, *args, **kwargs)
-
-        if out_a is None:
-            out_a = pymodalib.cachedarray(shape=(x, *_wt_a.shape), dtype=np.complex64)
-            out_b = pymodalib.cachedarray(shape=(x, *_wt_a.shape), dtype=np.complex64)
-
-        out_a[index, :, :] = _wt_a[:, :]
-        out_b[index, :, :] = _wt_b[:, :]
+    params = inspect.signature(wavelet_transform).bind(signal, fs, *args, **kwargs)
+    params.apply_defaults()
+    return params.arguments
 
-    return out_a, out_b
 
+def _wt_frequencies(signal: ndarray, fs: float, *args, **kwargs) -> ndarray:
+    """
+    Calculates the frequencies of the wavelet transform of a signal, which give the
+    dimensions of the wavelet transform. With the Python implementation, this does
+    not perform the wavelet transform itself.
+    """
+    p = _wt_arguments(signal, fs, *args, **kwargs)
 
-def _group_coherence(
-    wavelet_transforms_a: ndarray, wavelet_transforms_b: ndarray, mask: ndarray
-) -> ndarray:
-    coh_length = wavelet_transforms_a.shape[1]
-    out = np.empty((len(wavelet_transforms_a), len(wavelet_transforms_b), coh_length))
+    if p["implementation"] != "python":
+        _, freq = wt(signal, fs, *args, **kwargs)
+        return freq
 
-    for i, wt1 in enumerate(wavelet_transforms_a):
-        for j, wt2 in enumerate(wavelet_transforms_b):
-            if not mask[i, j]:
-                continue
+    return wavelet_frequencies(
+        len(signal),
+        fs,
+        window_params(p["wavelet"], p["resolution"]),
+        fmin=p["fmin"],
+        fmax=p["fmax"],
+        rel_tolerance=p["rel_tolerance"],
+        **p["kwargs"],
+    )
 
-            coh, _ = wphcoh(wt1, wt2)
-            out[i, j, :] = np.average(coh, axis=1)
 
-    return out
+def _init_worker(numba_threads: int) -> None:
+    """
+    Initializer for each process in the pool. Limits the number of threads used by the
+    Numba kernels in this process, so that the processes in the pool do not oversubscribe
+    the CPU between them.
+    """
+    numba.set_num_threads(numba_threads)
 
 
-def wrapper_pass_function(func: Callable) -> Any:
+def _create_pool() -> multiprocessing.pool.Pool:
     """
-    Wrapper which allows a Pool's 'starmap' to be called with a function that takes no parameters.
-
-    This is used to pass *args and **kwargs to a function, by creating a partial function with
-    `functools.partial` which is provided with all required arguments including the *args and **kwargs.
+    Creates a pool of processes which can be used to calculate group coherence.
+    """
+    # The processes must share the resource tracker of this process, which owns the
+    # shared arrays. The pool may be created before any shared arrays exist.
+    ensure_resource_tracker()
 
-    The partial function is then passed an an argument to this function in `starmap`.
+    processes = multiprocessing.cpu_count()
+    return multiprocessing.Pool(
+        processes=processes,
+        initializer=_init_worker,
+        initargs=(max(1, numba.config.NUMBA_NUM_THREADS // processes),),
+    )
 
-    Parameters
-    ----------
-    func : Callable
-        The partial function to run, which takes no parameters.
 
-    Returns
-    -------
-    Any
-        The return values from the partial function.
+def _run_attached(func: Callable, shared: Tuple[SharedArray, ...], *args) -> Any:
     """
-    return func()
+    Runs a task with the Numpy arrays backed by shared arrays, which are passed before
+    the other arguments, and then detaches this process from the shared arrays.
 
+    The pool may outlive a calculation, and the memory of an unlinked shared array is
+    not freed while any process still has it attached. Attaching again is cheap.
 
-def group_coherence_impl(
-    signals_a: ndarray,
-    signals_b: ndarray,
-    fs: float,
-    cleanup: bool = True,
-    percentile: float = 95,
-    *wavelet_args,
-    **wavelet_kwargs,
-) -> Tuple[ndarray, ndarray]:
-    """
-    For docstrings, please see the wrapper functions in 'pymodalib.algorithms'.
+    Shared arrays which are None are passed as None.
     """
     try:
-        xa, ya = signals_a.shape
-        xb, yb = signals_a.shape
-    except ValueError:
-        raise CoherenceException(
-            f"Cannot perform group coherence with only one pair of signals."
-        )
+        return func(*(None if s is None else s.array for s in shared), *args)
+    finally:
+        for s in filter(None, shared):
+            try:
+                s.close()
+            except BufferError:
+                # Views of the array are still referenced, e.g. by a traceback.
+                # The memory will be released when they are deleted.
+                pass
+
+
+def _store_phase(
+    wavelet_transform: ndarray, phase: ndarray, conjugate: bool = False
+) -> Tuple[bool, Optional[ndarray]]:
+    """
+    Stores the phase of a wavelet transform as unit complex numbers, which are 0 where the
+    wavelet transform is NaN. The phase may be stored in place of the wavelet transform.
 
-    if xa > ya:
-        warnings.warn(
-            f"Array dimensions {xa}, {ya} imply that the signals may be orientated incorrectly in the input arrays. "
-            f"If this is not the case, please ignore the warning.",
-            RuntimeWarning,
-        )
+    Returns whether the wavelet transform contains any NaN values, and a mask showing
+    where it is zero, which are needed to match the behaviour of `wphcoh`. The mask is
+    None if the wavelet transform does not contain any zero values.
+    """
+    zero = wavelet_transform == 0
 
-    # Create Pool for multiprocessing.
-    processes = multiprocessing.cpu_count()
-    pool = multiprocessing.Pool(processes=processes)
+    angle = np.angle(wavelet_transform).astype(np.float32, copy=False)
+    phase[:] = np.exp((-1j if conjugate else 1j) * angle)
 
-    # Calculate the first two wavelet transforms, so we know their dimensions.
-    args = [(signals_a[0, :], fs), (signals_b[0, :], fs)]
+    nan = np.isnan(phase)
+    has_nan = bool(nan.any())
+    if has_nan:
+        phase[nan] = 0
 
-    (wt_a, freq), (wt_b, _) = pool.starmap(
-        wrapper_pass_function,
-        [(functools.partial(wt, *a, *wavelet_args, **wavelet_kwargs),) for a in args],
-    )
-    if len(freq.shape) > 1:
-        freq = freq.reshape(freq.size)
+    return has_nan, zero if zero.any() else None
 
-    print(f"Finished calculating first pair of wavelet transforms.")
 
-    # Create empty arrays to hold all wavelet transforms.
-    wavelet_transforms_a = pymodalib.cachedarray(
-        shape=(xa, *wt_a.shape), dtype=np.complex64
-    )
-    wavelet_transforms_b = pymodalib.cachedarray(
-        shape=(xb, *wt_b.shape), dtype=np.complex64
-    )
+def _chunk_wt(
+    start: int,
+    end: int,
+    shared_signals: SharedArray,
+    shared_phase: SharedArray,
+    fs: float,
+    in_place: bool,
+    wavelet_args: tuple,
+    wavelet_kwargs: dict,
+) -> Tuple[bool, Dict[Tuple[int, int], ndarray]]:
+    """
+    Used to perform the wavelet transform for a chunk of the signals. The caller is
+    responsible for splitting the signals into chunks.
 
-    # Calculate how the signals will be split up, so each process can work on part of the group.
-    indices = np.arange(1, xa)
-    chunks = array_split(indices, processes)
-
-    args = []
-    for c in chunks:
-        start, end = c[0], c[-1]
-        if start == end:
-            end += 1
-
-        args.append((signals_a[start:end, :], signals_b[start:end, :], fs))
-
-    # Calculate wavelet transforms in parallel.
-    results = pool.starmap(
-        wrapper_pass_function,
-        [
-            (functools.partial(_chunk_wt, *a, *wavelet_args, **wavelet_kwargs),)
-            for a in args
-        ],
+    See `_chunk_phases`.
+    """
+    return _run_attached(
+        _chunk_phases,
+        (shared_signals, shared_phase),
+        start,
+        end,
+        fs,
+        in_place,
+        wavelet_args,
+        wavelet_kwargs,
     )
-    print(f"Finished calculating wavelet transforms.")
 
-    # Write the results from processes into the arrays containing the wavelet transforms.
-    for chunk, (result1, result2) in zip(chunks, results):
-        start, end = chunk[0], chunk[-1] + 1
 
-        wavelet_transforms_a[start:end, :, :] = result1[:, :, :]
-        wavelet_transforms_b[start:end, :, :] = result2[:, :, :]
+def _chunk_phases(
+    signals: ndarray,
+    phase: ndarray,
+    start: int,
+    end: int,
+    fs: float,
+    in_place: bool,
+    wavelet_args: tuple,
+    wavelet_kwargs: dict,
+) -> Tuple[bool, Dict[Tuple[int, int], ndarray]]:
+    """
+    Performs the wavelet transform for a chunk of the signals, and stores the phases.
+
+    Only the phases of the wavelet transforms are needed, so they are stored in the shared
+    arrays in place of the wavelet transforms. The phases of signals B are stored as their
+    complex conjugates. If `in_place` is True, which requires the Python implementation,
+    each wavelet transform is written directly into the shared array and then replaced
+    by its phase, so it is never copied.
+
+    Returns whether any of the wavelet transforms contain NaN values, and the masks
+    showing where they are zero, for the wavelet transforms which contain zeros. The
+    masks are indexed by the group (0 for signals A, 1 for signals B) and the index
+    of the signal.
+    """
+    has_nan = False
+    zeros = {}
+
+    for index in range(start, end):
+        for group in range(2):
+            target = phase[group, index]
+            kwargs = dict(wavelet_kwargs, out=target) if in_place else wavelet_kwargs
+
+            transform, _ = wt(signals[group, index, :], fs, *wavelet_args, **kwargs)
+
+            nan, zero = _store_phase(transform, target, conjugate=group == 1)
+            has_nan = has_nan or nan
+            if zero is not None:
+                zeros[group, index] = zero
+
+    return has_nan, zeros
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _wphcoh_kernel(
+    phase_a: ndarray,
+    phase_b_conj: ndarray,
+    has_nan: bool,
+    zero_a: ndarray,
+    zero_b: ndarray,
+    phph: ndarray,
+    count: ndarray,
+) -> None:
+    """
+    Adds the contribution of a tile of phases and conjugate phases, as stored by `_store_phase`,
+    to the running sums which give the wavelet phase coherence between every pair of signals.
+    The zero masks are empty if either set of wavelet transforms does not contain zeros.
 
+    When all tiles have been added, `abs(phph) / count` is equivalent to calling `wphcoh`
+    for each pair.
     """
-    Now we have the wavelet transform for every signal in the group.
+    na, fn, length = phase_a.shape
+    nb = phase_b_conj.shape[0]
+    check_zero = zero_a.size > 0 and zero_b.size > 0
+
+    for n in prange(na * nb):
+        i = n // nb
+        j = n % nb
+
+        for f in range(fn):
+            # Sum of exp(i * (phi1 - phi2)). The phases are 0 where they are not defined,
+            # so those times do not contribute.
+            acc = np.complex64(0)
+            for t in range(length):
+                acc += phase_a[i, f, t] * phase_b_conj[j, f, t]
+
+            # Like 'wphcoh', remove the contribution of times where both wavelet
+            # transforms are zero.
+            if check_zero:
+                both_zero = 0
+                for t in range(length):
+                    both_zero += zero_a[i, f, t] & zero_b[j, f, t]
+                acc -= both_zero
+
+            # Number of times where both phases are defined.
+            if has_nan:
+                valid = 0
+                for t in range(length):
+                    valid += (phase_a[i, f, t] != 0) & (phase_b_conj[j, f, t] != 0)
+            else:
+                valid = length
+
+            phph[i, j, f] += acc
+            count[i, j, f] += valid
+
+
+def _coherence(
+    phase: ndarray, zero: Optional[ndarray], a: slice, b: slice, has_nan: bool
+) -> ndarray:
+    """
+    Calculates the coherence between every pair of signals in a range of signals A
+    and a range of signals B. The result has dimensions (Na, Nb, F).
 
-    Next, we want to calculate the coherence between every signal A and B.
-    The coherences between unrelated signals (e.g. signal A1 and signal B2)
-    will be used as surrogates.
+    The zero mask is None if none of the wavelet transforms contain zeros.
+    """
+    has_zero = zero is not None
+
+    phase_a = phase[0, a]
+    phase_b_conj = phase[1, b]
+
+    if has_zero:
+        zero_a = zero[0, a]
+        zero_b = zero[1, b]
+    else:
+        zero_a = zero_b = np.empty((0, 0, 0), dtype=np.bool_)
+
+    na, fn, length = phase_a.shape
+    nb = len(phase_b_conj)
+
+    phph = np.zeros((na, nb, fn), dtype=np.complex64)
+    count = np.zeros((na, nb, fn), dtype=np.float32)
+
+    # Work on tiles of time, so that the phases of each tile stay in cache while they
+    # are used for every pair of signals.
+    time_tile = max(1, COHERENCE_TIME_TILE_ELEMENTS // fn)
+
+    for t in range(0, length, time_tile):
+        tile = slice(t, t + time_tile)
+        _wphcoh_kernel(
+            phase_a[:, :, tile],
+            phase_b_conj[:, :, tile],
+            has_nan,
+            zero_a[:, :, tile] if has_zero else zero_a,
+            zero_b[:, :, tile] if has_zero else zero_b,
+            phph,
+            count,
+        )
 
-    The group will have a coherence array like the following, where the cells marked
-    with "C" are the coherences between the signals for each subject in the group,
-    and the cells marked with "s" are the surrogates created by calculating the
-    coherence between unrelated signals.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.abs(phph) / count).astype(np.float32, copy=False)
 
-                |  sig_b_1  |  sig_b_2  |  sig_b_3  |  .....  |
-    | --------- | --------- | --------- | --------- |  -----  |
-    |  sig_a_1  |     C     |     s     |     s     |    s    |
-    |  sig_a_2  |     s     |     C     |     s     |    s    |
-    |  sig_a_3  |     s     |     s     |     C     |    s    |
-    |   .....   |     s     |     s     |     s     |    C    |
 
-    If 'max_surrogates' is smaller than the number of surrogates, then signal pairs for surrogates
-    will be chosen randomly. In the above array, spaces without surrogates will be filled with NaN values.
+def _surrogate_percentile(
+    row: ndarray, col: ndarray, percentile: float, coh_index: int
+) -> ndarray:
+    """
+    Calculates a percentile of the surrogates for one of the coherences, given the row
+    and column of the coherence array which contain it.
     """
+    # The surrogates are the row and column containing the desired coherence,
+    # without the coherence itself.
+    surrogates = np.concatenate(
+        [np.delete(row, coh_index, axis=0), np.delete(col, coh_index, axis=0)], axis=0
+    )
 
-    # Create empty array for coherence and surrogates.
-    coherence = np.empty((xa, *wavelet_transforms_a.shape[:-1]))
+    n = len(surrogates)
+    if n == 0 or np.isnan(surrogates).any():
+        surr_percentile = np.nanpercentile(surrogates, percentile, axis=0)
+    else:
+        # Linear interpolation between the two closest ranks, like 'np.percentile'.
+        # Partitioning around both ranks is much cheaper than sorting all surrogates.
+        position = percentile / 100 * (n - 1)
+        lower = int(np.floor(position))
+        upper = min(lower + 1, n - 1)
 
-    # The mask will show which elements are surrogates and can be skipped.
-    mask = np.empty(coherence.shape[:-1], dtype=np.bool)
-    mask.fill(True)
+        part = np.partition(surrogates, (lower, upper), axis=0)
+        surr_percentile = part[lower] + (part[upper] - part[lower]) * (position - lower)
 
-    indices = np.arange(0, len(coherence))
-    chunks = array_split(indices, processes)
+    surr_percentile[np.isnan(surr_percentile)] = 0
 
-    args = []
-    for c in chunks:
-        start, end = c[0], c[-1] + 1
+    return surr_percentile
 
-        # Split up into chunks by rows.
-        wavelets_a = wavelet_transforms_a[start:end, :, :]
-        mask_a = mask[start:end]
 
-        # Keep all columns instead of splitting into chunks.
-        wavelets_b = wavelet_transforms_b[:, :, :]
+def _group_coherence(
+    start: int,
+    end: int,
+    shared_phase: SharedArray,
+    shared_zero: Optional[SharedArray],
+    percentile: float,
+    has_nan: bool,
+) -> Tuple[ndarray, ndarray]:
+    """
+    Used to calculate the coherences for a range of subjects. The caller is responsible
+    for splitting the subjects into ranges.
 
-        args.append((wavelets_a, wavelets_b, mask_a))
+    See `_range_coherence`.
+    """
+    return _run_attached(
+        _range_coherence,
+        (shared_phase, shared_zero),
+        start,
+        end,
+        percentile,
+        has_nan,
+    )
 
-    del wavelet_transforms_a
-    del wavelet_transforms_b
 
-    # Calculate coherences and surrogates in parallel.
-    results = pool.starmap(_group_coherence, args)
-    print(f"Finished calculating coherence.")
+def _range_coherence(
+    phase: ndarray,
+    zero: Optional[ndarray],
+    start: int,
+    end: int,
+    percentile: float,
+    has_nan: bool,
+) -> Tuple[ndarray, ndarray]:
+    """
+    Calculates the coherences between signals A and B for a range of subjects, and a
+    percentile of the surrogates for each coherence.
 
-    # Write the results from processes into the coherence array.
-    for chunk, result in zip(chunks, results):
-        start, end = chunk[0], chunk[-1] + 1
+    The rows and columns of the coherence array are calculated in batches of subjects,
+    so the full coherence array is never stored.
+    """
+    fn = phase.shape[2]
 
-        coherence[start:end, :] = result[:, :]
+    real_coherences = np.empty((end - start, fn), dtype=np.float32)
+    surr_percentiles = np.empty((end - start, fn), dtype=np.float32)
 
-    del results
+    for batch in range(start, end, COHERENCE_BATCH_SIZE):
+        ks = slice(batch, min(batch + COHERENCE_BATCH_SIZE, end))
 
-    # Set all skipped surrogates to NaN.
-    coherence[~mask, :] = np.nan
+        rows = _coherence(phase, zero, ks, slice(None), has_nan)
+        cols = _coherence(phase, zero, slice(None), ks, has_nan)
+
+        for index, k in enumerate(range(ks.start, ks.stop)):
+            real_coherences[k - start] = rows[index, k]
+            surr_percentiles[k - start] = _surrogate_percentile(
+                rows[index], cols[:, index], percentile, k
+            )
+
+    return real_coherences, surr_percentiles
 
-    """
-    Now we have a large array containing the coherence between all signals.
 
-    The values on the diagonal are the useful coherences. For each element
-    on the diagonal, the surrogates will be the row and column to which the
-    element belongs. A percentile of these surrogates will be taken, and the
-    result will be subtracted from the coherence (the diagonal element).
+def group_coherence_impl(
+    signals_a: ndarray,
+    signals_b: ndarray,
+    fs: float,
+    cleanup: bool = True,
+    percentile: float = 95,
+    pool: multiprocessing.pool.Pool = None,
+    *wavelet_args,
+    **wavelet_kwargs,
+) -> Tuple[ndarray, ndarray]:
+    """
+    For docstrings, please see the wrapper functions in 'pymodalib.algorithms'.
 
-    These diagonal elements will be returned in the result.
+    If a pool of processes is passed, it is used instead of creating a new pool and
+    is left open afterwards, so that it can be reused by the caller. The pool should
+    be created by `_create_pool`.
     """
+    try:
+        xa, ya = signals_a.shape
+        xb, yb = signals_b.shape
+    except ValueError:
+        raise CoherenceException(
+            f"Cannot perform group coherence with only one pair of signals."
+        )
 
-    # Indices along the diagonal of the coherence array.
-    # These correspond to the useful coherences; other values are surrogates.
-    diag = np.diag_indices(xa)
-    real_coherences = coherence[diag]
+    if xa != xb or ya != yb:
+        raise CoherenceException(
+            "Dimensions of input arrays do not match. "
+            "The dimensions of signals A and signals B must be the same."
+        )
 
-    # Set the coherences to NaN, so we're left with the surrogates only.
-    coherence[diag] = np.nan
+    if xa > ya:
+        warnings.warn(
+            f"Array dimensions {xa}, {ya} imply that the signals may be orientated incorrectly in the input arrays. "
+            f"If this is not the case, please ignore the warning.",
+            RuntimeWarning,
+        )
 
-    residual_coherence = real_coherences
+    # Calculate the frequencies of the wavelet transforms, so we know their dimensions.
+    freq = _wt_frequencies(signals_a[0, :], fs, *wavelet_args, **wavelet_kwargs)
+    if len(freq.shape) > 1:
+        freq = freq.reshape(freq.size)
 
-    # For each coherence, subtract a percentile of the surrogates.
-    for coh_index in range(len(residual_coherence)):
-        # Create a copy of the array, since we need to write NaNs into it.
-        surrogates = coherence.copy()
+    # Only the Python implementation can write wavelet transforms into shared memory.
+    arguments = _wt_arguments(signals_a[0, :], fs, *wavelet_args, **wavelet_kwargs)
+    in_place = arguments["implementation"] == "python"
 
-        N = len(surrogates)
-        for i in range(N):
-            for j in range(N):
-                # Set every row and column which doesn't contain the desired coherence to NaN.
-                if i != coh_index and j != coh_index:
-                    surrogates[i, j, :] = np.nan
+    # The shared arrays and the pool must be released even if the calculation fails,
+    # since the shared arrays are not removed by 'pymodalib.cleanup'.
+    shared_signals = shared_phase = shared_zero = None
+    own_pool = pool is None
 
-        surr_percentile = np.nanpercentile(surrogates, percentile, axis=(0, 1,))
-        surr_percentile[np.isnan(surr_percentile)] = 0
+    try:
+        # Store both sets of signals in one contiguous single-precision array, with
+        # dimensions (2, N, L). This is shared with the processes in the pool, so it
+        # will not be copied.
+        shared_signals = SharedArray(shape=(2, xa, ya), dtype=np.float32)
+        signals = shared_signals.array
+        signals[0] = signals_a
+        signals[1] = signals_b
+        del signals
+
+        # Create an empty array to hold the phases of all wavelet transforms. This is
+        # also shared with the processes in the pool.
+        shared_phase = SharedArray(shape=(2, xa, len(freq), ya), dtype=np.complex64)
+
+        # Create Pool for multiprocessing, unless one was passed by the caller.
+        if own_pool:
+            pool = _create_pool()
+
+        processes = multiprocessing.cpu_count()
+
+        # Calculate how the signals will be split up, so each process can work on part
+        # of the group.
+        indices = np.arange(0, xa)
+        chunks = array_split(indices, processes)
+        ranges = [(c[0], c[-1] + 1) for c in chunks]
+
+        # Calculate wavelet transforms in parallel.
+        chunk_results = pool.starmap(
+            _chunk_wt,
+            [
+                (
+                    start,
+                    end,
+                    shared_signals,
+                    shared_phase,
+                    fs,
+                    in_place,
+                    wavelet_args,
+                    wavelet_kwargs,
+                )
+                for start, end in ranges
+            ],
+            chunksize=1,
+        )
+        has_nan = any(nan for nan, _ in chunk_results)
+        print(f"Finished calculating wavelet transforms.")
+
+        # Wavelet transforms rarely contain zeros, so the array showing where they are
+        # zero is only created if it is needed.
+        zeros = [z for _, chunk_zeros in chunk_results for z in chunk_zeros.items()]
+        del chunk_results
+
+        if zeros:
+            shared_zero = SharedArray(shape=shared_phase.shape, dtype=np.bool_)
+            zero = shared_zero.array
+            zero.fill(False)
+            for (group, index), mask in zeros:
+                zero[group, index] = mask
+            del zero
+        del zeros
+
+        """
+        Now we have the phase of the wavelet transform for every signal in the group.
+
+        Next, we want to calculate the coherence between every signal A and B.
+        The coherences between unrelated signals (e.g. signal A1 and signal B2)
+        will be used as surrogates.
+
+        The group has a coherence array like the following, where the cells marked
+        with "C" are the coherences between the signals for each subject in the group,
+        and the cells marked with "s" are the surrogates created by calculating the
+        coherence between unrelated signals.
+
+                    |  sig_b_1  |  sig_b_2  |  sig_b_3  |  .....  |
+        | --------- | --------- | --------- | --------- |  -----  |
+        |  sig_a_1  |     C     |     s     |     s     |    s    |
+        |  sig_a_2  |     s     |     C     |     s     |    s    |
+        |  sig_a_3  |     s     |     s     |     C     |    s    |
+        |   .....   |     s     |     s     |     s     |    C    |
+
+        For each coherence "C", the surrogates are the row and column to which it belongs.
+        A percentile of these surrogates will be subtracted from the coherence.
+
+        The full array may be too large to hold in memory, so each process calculates only
+        the rows and columns for its range of subjects. Each surrogate is calculated twice,
+        once for its row and once for its column.
+        """
+
+        # Calculate coherences and surrogate percentiles in parallel.
+        results = pool.starmap(
+            _group_coherence,
+            [
+                (start, end, shared_phase, shared_zero, percentile, has_nan)
+                for start, end in ranges
+            ],
+            chunksize=1,
+        )
+        print(f"Finished calculating coherence.")
+    finally:
+        if own_pool and pool is not None:
+            pool.close()
+            pool.join()
+
+        for shared in (shared_signals, shared_phase, shared_zero):
+            if shared is not None:
+                shared.unlink()
 
-        residual_coherence[coh_index] -= surr_percentile
+    real_coherences = np.concatenate([real for real, _ in results])
+    surr_percentiles = np.concatenate([surr for _, surr in results])
 
-    residual_coherence[residual_coherence < 0] = 0
+    residual_coherence = real_coherences - surr_percentiles
+    np.maximum(residual_coherence, 0, out=residual_coherence)
 
-    del coherence
-    del surr_percentile
+    del results
+    del surr_percentiles
 
     if cleanup:
         pymodalib.cleanup()
@@ -334,24 +630,32 @@ def dual_group_coherence_impl(
             RuntimeWarning,
         )
 
-    result1 = group_coherence_impl(
-        group1_signals1,
-        group1_signals2,
-        fs,
-        cleanup=False,
-        percentile=percentile,
-        *wavelet_args,
-        **wavelet_kwargs,
-    )
-    result2 = group_coherence_impl(
-        group2_signals1,
-        group2_signals2,
-        fs,
-        cleanup=False,
-        percentile=percentile,
-        *wavelet_args,
-        **wavelet_kwargs,
-    )
+    # Both groups use the same pool, so the processes are only started once.
+    pool = _create_pool()
+    try:
+        result1 = group_coherence_impl(
+            group1_signals1,
+            group1_signals2,
+            fs,
+            cleanup=False,
+            percentile=percentile,
+            pool=pool,
+            *wavelet_args,
+            **wavelet_kwargs,
+        )
+        result2 = group_coherence_impl(
+            group2_signals1,
+            group2_signals2,
+            fs,
+            cleanup=False,
+            percentile=percentile,
+            pool=pool,
+            *wavelet_args,
+            **wavelet_kwargs,
+        )
+    finally:
+        pool.close()
+        pool.join()
 
     pymodalib.cleanup()
 
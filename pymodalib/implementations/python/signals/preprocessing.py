@@ -13,8 +13,112 @@
 #
 #  You should have received a copy of the GNU General Public License
 #  along with this program. If not, see <https://www.gnu.org/licenses/>.
+import functools
+from typing import Tuple
+
 import numpy as np
+from numba import njit
 from numpy import ndarray
+from scipy.fft import fft, ifft
+
+
+@njit(cache=True, fastmath=True)
+def _detrend_matrix(L: int, fs: float) -> ndarray:
+    """
+    Creates the (Lx4) design matrix for fitting a third-order polynomial to a signal.
+
+    The columns are stored contiguously, and each column is filled and standardized
+    in place without any temporary arrays.
+    """
+    XM = np.empty((4, L))
+    XM[0, :] = 1.0
+
+    for pn in range(1, 4):
+        col = XM[pn]
+
+        total = 0.0
+        for k in range(L):
+            value = ((k + 1) / fs) ** pn
+            col[k] = value
+            total += value
+        mean = total / L
+
+        total = 0.0
+        for k in range(L):
+            diff = col[k] - mean
+            total += diff * diff
+        std = np.sqrt(total / L)
+
+        for k in range(L):
+            col[k] = (col[k] - mean) / std
+
+    return XM.T
+
+
+@functools.lru_cache(maxsize=8)
+def _detrend_basis(L: int, fs: float) -> Tuple[ndarray, ndarray]:
+    """
+    Returns the design matrix for the third-order polynomial fit and its pseudoinverse.
+
+    These only depend on the length and sampling frequency of the signal, so they are
+    cached for signals which are preprocessed with the same parameters. The returned
+    arrays are read-only, because they are shared between calls.
+
+    The pseudoinverse is calculated from the normal equations, which only involve a
+    (4x4) matrix instead of the SVD of the tall (Lx4) design matrix. The columns are
+    standardized, so the normal equations are well-conditioned.
+    """
+    XM = _detrend_matrix(L, fs)
+    gram = XM.T @ XM
+
+    if L >= 4:
+        XM_pinv = np.linalg.solve(gram, XM.T)
+    else:
+        # Too few samples for a third-order fit, so the normal equations are singular.
+        XM_pinv = np.linalg.pinv(gram) @ XM.T
+
+    XM.setflags(write=False)
+    XM_pinv.setflags(write=False)
+    return XM, XM_pinv
+
+
+def _passband(L: int, fs: float, fmin: float, fmax: float) -> Tuple[int, int]:
+    """
+    Calculates the range of FFT bins which are kept by the band-pass filter, i.e. the bins
+    whose absolute frequency is greater than `max(fmin, fs / L)` and smaller than `fmax`.
+
+    Bins are counted from 0 Hz, so bin `k` corresponds to both the positive frequency
+    at index `k` and the negative frequency at index `L - k` of the FFT.
+
+    Returns the first and last bin in the pass band.
+    """
+    low = max(float(np.max(fmin)), fs / L)
+    fmax = float(fmax)
+    nyquist = L // 2
+
+    # Smallest bin whose frequency is greater than 'low'. Comparisons with NaN are false,
+    # so a NaN frequency does not remove any bins. Bins above Nyquist are never searched,
+    # since the pass band is empty if it starts there.
+    if np.isnan(low):
+        k_lo = 0
+    else:
+        k_lo = int(np.floor(min(low * L / fs, nyquist + 1)))
+        while k_lo <= nyquist and k_lo * fs / L <= low:
+            k_lo += 1
+        while k_lo > 0 and (k_lo - 1) * fs / L > low:
+            k_lo -= 1
+
+    # Largest bin whose frequency is smaller than 'fmax'.
+    if np.isnan(fmax):
+        k_hi = nyquist
+    else:
+        k_hi = int(np.ceil(min(max(fmax * L / fs, -1), nyquist)))
+    while k_hi >= 0 and k_hi * fs / L >= fmax:
+        k_hi -= 1
+    while k_hi < nyquist and (k_hi + 1) * fs / L < fmax:
+        k_hi += 1
+
+    return k_lo, k_hi
 
 
 def preprocess_impl(sig: ndarray, fs: float, fmin: float, fmax: float) -> ndarray:
@@ -33,28 +137,23 @@ def preprocess_impl(sig: ndarray, fs: float, fmin: float, fmax: float) -> ndarra
     L = len(sig)
 
     # De-trending.
-    X = np.arange(1, len(sig) + 1).T / fs
-    XM = np.ones((len(X), 4))
-
-    for pn in range(1, 4):
-        CX = X ** pn
-        XM[:, pn] = (CX - np.mean(CX)) / np.std(CX)
-
-    sig = sig.reshape(len(sig), 1)
-    new_sig = sig - XM @ ((np.linalg.pinv(XM)) @ sig)
+    sig = np.asarray(sig, dtype=np.float64).reshape(L)
+    XM, XM_pinv = _detrend_basis(L, float(fs))
+    new_sig = (sig - XM @ (XM_pinv @ sig)).reshape(L, 1)
 
     # Filtering.
-    fx = np.fft.fft(new_sig, axis=0)
-    Nq = np.int32(np.ceil((L + 1) / 2))
-
-    ff = np.concatenate([np.arange(0, Nq), -np.flip(np.arange(1, L - Nq + 1))]) * fs / L
-    ff = ff.reshape(len(ff), 1)
-
-    abs_ff = np.abs(ff)
+    fx = fft(new_sig, axis=0, overwrite_x=True, workers=-1)
+    k_lo, k_hi = _passband(L, fs, fmin, fmax)
 
-    fx[(abs_ff <= np.max([fmin, fs / L])) | (abs_ff >= fmax)] = 0
+    if k_lo > k_hi:
+        fx[:] = 0
+    else:
+        # Zero the frequencies below the pass band, including 0 Hz, then the frequencies above it.
+        fx[:k_lo] = 0
+        fx[L - k_lo + 1 :] = 0
+        fx[k_hi + 1 : L - k_hi] = 0
 
-    result = np.real(np.fft.ifft(fx, axis=0))
+    result = np.real(ifft(fx, axis=0, overwrite_x=True, workers=-1))
 
     try:
         x, y = result.shape
@@ -222,6 +222,79 @@ class LognormWavelet(WindowParams):
         return np.exp(-(self.q ** 2 / 2) * rv)
 
 
+def window_params(wavelet: str, resolution: float) -> WindowParams:
+    """
+    Creates the window parameters for a wavelet, given its name and resolution.
+    """
+    if wavelet == "Lognorm":
+        return LognormWavelet(resolution)
+    elif wavelet == "Morlet":
+        return MorletWavelet(resolution)
+    elif wavelet == "Bump":
+        raise Exception("Bump wavelet is not supported yet.")
+    elif wavelet == "Morse-a":
+        return MorseWavelet(3, resolution)
+
+    raise ValueError(f"Unknown wavelet: '{wavelet}'")
+
+
+def wavelet_frequencies(
+    signal_length: int,
+    fs: float,
+    wp: WindowParams,
+    fmin: float = None,
+    fmax: float = None,
+    rel_tolerance: float = 0.01,
+    nv: int = None,
+    *args,
+    **kwargs,
+) -> ndarray:
+    """
+    Calculates the frequencies at which `wavelet_transform` would calculate the WT of a signal,
+    without performing the transform. The number of frequencies is the first dimension of the WT.
+    """
+    fmax = fmax or fs / 2
+
+    twf = []
+    if wp.has_twf:
+        twf = wp.twf
+
+    parcalc(rel_tolerance, signal_length, wp, wp.fwt, twf, False, wp.f0, fmax, fs=fs)
+
+    if isempty(fmin):
+        fmin = _default_fmin(wp, fs, signal_length)
+
+    if isempty(nv):
+        nv = ceil(_optimal_nv(wp))
+
+    return _frequencies(fmin, fmax, nv)
+
+
+def _default_fmin(wp: WindowParams, fs: float, L: int) -> float:
+    """
+    The minimal frequency for which at least one WT coefficient is determined up to the
+    relative tolerance. Requires the window parameters to be estimated by `parcalc`.
+    """
+    return wp.ompeak / twopi * (wp.t2e - wp.t1e) * fs / L
+
+
+def _optimal_nv(wp: WindowParams) -> float:
+    """
+    The optimal number of voices. Requires the window parameters to be estimated by `parcalc`.
+    """
+    Nb = 10
+    return Nb * log(2) / log(wp.xi2h / wp.xi1h)
+
+
+def _frequencies(fmin: float, fmax: float, nv: int) -> ndarray:
+    """
+    The frequencies of the WT, spaced logarithmically with 'nv' voices per octave.
+    """
+    return 2 ** (
+        arange(ceil(nv * np.log2(fmin)), np.floor(nv * np.log2(fmax)) + 1).conj().T / nv
+    )
+
+
 def wavelet_transform(
     signal: ndarray,
     fs: float,
@@ -236,6 +309,7 @@ def wavelet_transform(
     nv: int = None,
     parallel: bool = None,
     return_opt: bool = False,
+    out: ndarray = None,
     *args,
     **kwargs,
 ):
@@ -265,7 +339,7 @@ def wavelet_transform(
         parcalc(rel_tolerance, L, wp, fwt, twf, disp_mode, f0, fmax, fs=fs)
 
     if isempty(fmin):
-        fmin = wp.ompeak / twopi * (wp.t2e - wp.t1e) * fs / L
+        fmin = _default_fmin(wp, fs, L)
 
     if fmin > fmax:
         print("WARNING: fmin must be smaller than fmax.")
@@ -280,17 +354,13 @@ def wavelet_transform(
     nvsim = nv
     wp.nv = nv
     if isempty(nv):
-        Nb = 10
-
-        wp.nv = Nb * log(2) / log(wp.xi2h / wp.xi1h)
+        wp.nv = _optimal_nv(wp)
         nv = ceil(wp.nv)
 
         if disp_mode:
             print(f"Optimal nv determined to be {nv}")
 
-    freq = 2 ** (
-        arange(ceil(nv * np.log2(fmin)), np.floor(nv * np.log2(fmax)) + 1).conj().T / nv
-    )
+    freq = _frequencies(fmin, fmax, nv)
     SN = len(freq)
 
     wp.t1e = wp.t1e.reshape(len(wp.t1e))
@@ -388,7 +458,19 @@ def wavelet_transform(
         coib1.fill(0)
         coib2.fill(0)
 
-    WT = np.empty((SN, L), dtype=np.complex64)
+    # The WT can be written into an existing array, e.g. in shared memory.
+    if out is None:
+        WT = np.empty((SN, L), dtype=np.complex64)
+    elif (
+        out.shape != (SN, L)
+        or out.dtype != np.complex64
+        or not out.flags.c_contiguous
+    ):
+        raise ValueError(
+            f"Output array must be a contiguous complex64 array with dimensions {(SN, L)}."
+        )
+    else:
+        WT = out
 
     if parallel and sys.version_info >= (3, 8,):
         import multiprocessing as mp
@@ -435,7 +517,7 @@ def wavelet_transform(
         pool.starmap(_calc_wt_rows, args)
 
         # Reallocate the data from shared memory.
-        WT = np.empty(sm_WT.shape, dtype=sm_WT.dtype)
+        WT = np.empty(sm_WT.shape, dtype=sm_WT.dtype) if out is None else out
         WT[:, :] = sm_WT[:, :]
 
         # Cleanup shared memory.
@@ -0,0 +1,142 @@
+#  PyMODAlib, a Python implementation of the algorithms from MODA (Multiscale Oscillatory Dynamics Analysis).
+#  Copyright (C) 2020 Lancaster University
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Numpy arrays whose data can be shared between processes without copying.
+"""
+
+import os
+import sys
+from typing import Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from pymodalib.utils.cache import cachedarray
+
+# 'multiprocessing.shared_memory' was added in Python 3.8.
+has_shared_memory = sys.version_info >= (3, 8)
+
+
+def ensure_resource_tracker() -> None:
+    """
+    Starts the resource tracker for shared memory in this process, if it is not
+    already running.
+
+    Processes which are started afterwards, e.g. by a pool, share this tracker.
+    Otherwise they start their own trackers when they attach to a shared array,
+    which warn about the array and try to unlink it again when the process exits.
+    """
+    if has_shared_memory and os.name == "posix":
+        from multiprocessing import resource_tracker
+
+        resource_tracker.ensure_running()
+
+
+class SharedArray:
+    """
+    A Numpy array which can be passed to other processes without copying its data.
+
+    Only the name, shape and data type of the array are pickled. Each process attaches
+    to the same memory when it accesses `array`.
+
+    On Python 3.8 and above, the data is stored in shared memory. On older versions of
+    Python, it is stored in a cached array.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype):
+        """
+        Creates a shared array. The process which creates the array is responsible
+        for calling `unlink` when the array is no longer needed.
+
+        :param shape: the shape of the array
+        :param dtype: the data type of the array
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        self._shm = None
+        self._array = None
+
+        if has_shared_memory:
+            from multiprocessing.shared_memory import SharedMemory
+
+            size = int(np.prod(self.shape)) * self.dtype.itemsize
+            self._shm = SharedMemory(create=True, size=max(size, 1))
+            self.name = self._shm.name
+        else:
+            self._array = cachedarray(shape=self.shape, dtype=self.dtype)
+            self.name = self._array.filename
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        state["_array"] = None
+        return state
+
+    @property
+    def array(self) -> ndarray:
+        """
+        The Numpy array backed by the shared data.
+        """
+        if self._array is None:
+            if has_shared_memory:
+                if self._shm is None:
+                    from multiprocessing.shared_memory import SharedMemory
+
+                    self._shm = SharedMemory(name=self.name)
+
+                self._array = np.ndarray(
+                    self.shape, dtype=self.dtype, buffer=self._shm.buf
+                )
+            else:
+                self._array = np.memmap(
+                    self.name, shape=self.shape, dtype=self.dtype, mode="r+"
+                )
+
+        return self._array
+
+    def close(self) -> None:
+        """
+        Detaches this process from the shared data. Any views of `array` must be deleted first.
+        """
+        self._array = None
+
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def unlink(self) -> None:
+        """
+        Frees the shared data. This should only be called by the process which created the array,
+        after all other processes have finished using it.
+        """
+        shm = self._shm
+        self.close()
+
+        if has_shared_memory:
+            if shm is None:
+                from multiprocessing.shared_memory import SharedMemory
+
+                shm = SharedMemory(name=self.name)
+                shm.close()
+
+            shm.unlink()
+        else:
+            try:
+                os.remove(self.name)
+            except OSError:
+                pass